@@ -1,3 +1,4 @@
+import datetime
 import functools
 import re
 
@@ -5,18 +6,19 @@
 from ..utils import (
     ExtractorError,
     OnDemandPagedList,
-    date_from_str,
     determine_ext,
     int_or_none,
     qualities,
     traverse_obj,
-    unified_strdate,
     unified_timestamp,
     update_url_query,
     url_or_none,
     urlencode_postdata,
 )
 
+_VIDEO_KEY_RE = re.compile(r'^(?P<upload_date>\d{8})_\w+_(?P<part>\d+)$')
+_UPLOAD_DATE_RE = re.compile(r'^(\d{8})_')
+
 
 class AfreecaTVIE(InfoExtractor):
     IE_NAME = 'afreecatv'
@@ -34,6 +36,21 @@ class AfreecaTVIE(InfoExtractor):
                         (?P<id>\d+)
                     '''
     _NETRC_MACHINE = 'afreecatv'
+    _LOGIN_ERRORS = {
+        -4: 'Your account has been suspended due to a violation of our terms and policies.',
+        -5: 'https://member.afreecatv.com/app/user_delete_progress.php',
+        -6: 'https://login.afreecatv.com/membership/changeMember.php',
+        -8: "Hello! AfreecaTV here.\nThe username you have entered belongs to \n an account that requires a legal guardian's consent. \nIf you wish to use our services without restriction, \nplease make sure to go through the necessary verification process.",
+        -9: 'https://member.afreecatv.com/app/pop_login_block.php',
+        -11: 'https://login.afreecatv.com/afreeca/second_login.php',
+        -12: 'https://member.afreecatv.com/app/user_security.php',
+        0: 'The username does not exist or you have entered the wrong password.',
+        -1: 'The username does not exist or you have entered the wrong password.',
+        -3: 'You have entered your username/password incorrectly.',
+        -7: 'You cannot use your Global AfreecaTV account to access Korean AfreecaTV.',
+        -10: 'Sorry for the inconvenience. \nYour account has been blocked due to an unauthorized access. \nPlease contact our Help Center for assistance.',
+        -32008: 'You have failed to log in. Please contact our Help Center.',
+    }
     _TESTS = [{
         'url': 'http://live.afreecatv.com:8079/app/index.cgi?szType=read_ucc_bbs&szBjId=dailyapril&nStationNo=16711924&nBbsNo=18605867&nTitleNo=36164052&szSkin=',
         'md5': 'f72c89fe7ecc14c1b5ce506c4996046e',
@@ -128,10 +145,14 @@ class AfreecaTVIE(InfoExtractor):
         },
     }]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._view_cache = {}
+
     @staticmethod
     def parse_video_key(key):
         video_key = {}
-        m = re.match(r'^(?P<upload_date>\d{8})_\w+_(?P<part>\d+)$', key)
+        m = _VIDEO_KEY_RE.match(key)
         if m:
             video_key['upload_date'] = m.group('upload_date')
             video_key['part'] = int(m.group('part'))
@@ -152,55 +173,43 @@ def _perform_login(self, username, password):
             'https://login.afreecatv.com/app/LoginAction.php', None,
             'Logging in', data=urlencode_postdata(login_form))
 
-        _ERRORS = {
-            -4: 'Your account has been suspended due to a violation of our terms and policies.',
-            -5: 'https://member.afreecatv.com/app/user_delete_progress.php',
-            -6: 'https://login.afreecatv.com/membership/changeMember.php',
-            -8: "Hello! AfreecaTV here.\nThe username you have entered belongs to \n an account that requires a legal guardian's consent. \nIf you wish to use our services without restriction, \nplease make sure to go through the necessary verification process.",
-            -9: 'https://member.afreecatv.com/app/pop_login_block.php',
-            -11: 'https://login.afreecatv.com/afreeca/second_login.php',
-            -12: 'https://member.afreecatv.com/app/user_security.php',
-            0: 'The username does not exist or you have entered the wrong password.',
-            -1: 'The username does not exist or you have entered the wrong password.',
-            -3: 'You have entered your username/password incorrectly.',
-            -7: 'You cannot use your Global AfreecaTV account to access Korean AfreecaTV.',
-            -10: 'Sorry for the inconvenience. \nYour account has been blocked due to an unauthorized access. \nPlease contact our Help Center for assistance.',
-            -32008: 'You have failed to log in. Please contact our Help Center.',
-        }
-
         result = int_or_none(response.get('RESULT'))
         if result != 1:
-            error = _ERRORS.get(result, 'You have failed to log in.')
+            error = self._LOGIN_ERRORS.get(result, 'You have failed to log in.')
             raise ExtractorError(
-                'Unable to login: %s said: %s' % (self.IE_NAME, error),
+                f'Unable to login: {self.IE_NAME} said: {error}',
                 expected=True)
 
+    def _download_view_data(self, video_id, url, partial_view=False, adult_view=False):
+        cache_key = (video_id, partial_view, adult_view)
+        if cache_key not in self._view_cache:
+            form = {
+                'nTitleNo': video_id,
+                'nApiLevel': 10,
+            }
+            if partial_view:
+                form['partialView'] = 'SKIP_ADULT'
+            if adult_view:
+                form['adultView'] = 'ADULT_VIEW'
+            self._view_cache[cache_key] = self._download_json(
+                'https://api.m.afreecatv.com/station/video/a/view', video_id,
+                headers={'Referer': url}, data=urlencode_postdata(form))['data']
+        return self._view_cache[cache_key]
+
     def _real_extract(self, url):
         video_id = self._match_id(url)
 
         partial_view = False
-        adult_view = False
+        # A logged in user is expected to be able to view adult content, so
+        # request it straight away instead of waiting for an ADULT flag
+        adult_view = self._get_login_info()[0] is not None
         for _ in range(2):
-            data = self._download_json(
-                'https://api.m.afreecatv.com/station/video/a/view',
-                video_id, headers={'Referer': url}, data=urlencode_postdata({
-                    'nTitleNo': video_id,
-                    'nApiLevel': 10,
-                }))['data']
-            if traverse_obj(data, ('code', {int})) == -6221:
+            data = self._download_view_data(video_id, url, partial_view, adult_view)
+            if data.get('code') == -6221:
                 raise ExtractorError('The VOD does not exist', expected=True)
-            query = {
-                'nTitleNo': video_id,
-                'nStationNo': data['station_no'],
-                'nBbsNo': data['bbs_no'],
-            }
-            if partial_view:
-                query['partialView'] = 'SKIP_ADULT'
-            if adult_view:
-                query['adultView'] = 'ADULT_VIEW'
 
             flag = data['flag']
-            if flag and flag == 'SUCCEED':
+            if flag == 'SUCCEED':
                 break
             if flag == 'PARTIAL_ADULT':
                 self.report_warning(
@@ -217,14 +226,17 @@ def _real_extract(self, url):
             else:
                 error = flag
             raise ExtractorError(
-                '%s said: %s' % (self.IE_NAME, error), expected=True)
+                f'{self.IE_NAME} said: {error}', expected=True)
         else:
+            # reached when the second attempt still asks for different view flags,
+            # e.g. PARTIAL_ADULT after ADULT
             raise ExtractorError('Unable to download video info')
 
-        video_element = data['files'][-1]
+        file_elements = data['files']
+        video_element = file_elements[-1]
         if video_element is None:
             raise ExtractorError(
-                'Video %s does not exist' % video_id, expected=True)
+                f'Video {video_id} does not exist', expected=True)
 
         video_url = str(video_element).strip()
 
@@ -235,44 +247,35 @@ def _real_extract(self, url):
         duration = data['total_file_duration']
         thumbnail = data['thumb']
 
-        common_entry = {
-            'uploader': uploader,
-            'uploader_id': uploader_id,
-            'thumbnail': thumbnail,
-        }
-
-        info = common_entry.copy()
-        info.update({
-            'id': video_id,
-            'title': title,
-            'duration': duration,
-        })
-
         if video_url:
             entries = []
-            file_elements = data['files']
             one = len(file_elements) == 1
-            for file_num, file_element in enumerate(file_elements, start=1):
-                file_url = url_or_none(file_element['file'])
-                if not file_url:
-                    continue
-                key = file_element['file_info_key']
-                upload_date = unified_strdate(self._search_regex(
-                    r'^(\d{8})_', key, 'upload date', default=None))
+            # part numbers follow the position in the files list, including invalid entries
+            valid_files = [
+                (file_num, file_url, int_or_none(file_element['duration']), file_element['file_info_key'])
+                for file_num, file_element in enumerate(file_elements, start=1)
+                if (file_url := url_or_none(file_element['file']))]
+            for file_num, file_url, file_duration, key in valid_files:
+                mobj = _UPLOAD_DATE_RE.match(key)
+                upload_date = mobj.group(1) if mobj else None
                 if upload_date is not None:
                     # sometimes the upload date isn't included in the file name
-                    # instead, another random ID is, which may parse as a valid
-                    # date but be wildly out of a reasonable range
-                    parsed_date = date_from_str(upload_date)
-                    if parsed_date.year < 2000 or parsed_date.year >= 2100:
+                    # instead, another random ID is, which may not be a valid date
+                    # or may parse as one but be wildly out of a reasonable range
+                    try:
+                        parsed_date = datetime.date(
+                            int(upload_date[:4]), int(upload_date[4:6]), int(upload_date[6:]))
+                    except ValueError:
                         upload_date = None
-                file_duration = int_or_none(file_element['duration'])
-                format_id = key if key else '%s_%s' % (video_id, file_num)
+                    else:
+                        if not 2000 <= parsed_date.year < 2100:
+                            upload_date = None
+                format_id = key if key else f'{video_id}_{file_num}'
                 if determine_ext(file_url) == 'm3u8':
                     formats = self._extract_m3u8_formats(
                         file_url, video_id, 'mp4', entry_protocol='m3u8_native',
                         m3u8_id='hls',
-                        note='Downloading part %d m3u8 information' % file_num)
+                        note=f'Downloading part {file_num} m3u8 information')
                 else:
                     formats = [{
                         'url': file_url,
@@ -280,21 +283,26 @@ def _real_extract(self, url):
                     }]
                 if not formats and not self.get_param('ignore_no_formats'):
                     continue
-                file_info = common_entry.copy()
-                file_info.update({
+                entries.append({
                     'id': format_id,
-                    'title': title if one else '%s (part %d)' % (title, file_num),
+                    'title': title if one else f'{title} (part {file_num})',
+                    'uploader': uploader,
+                    'uploader_id': uploader_id,
+                    'thumbnail': thumbnail,
                     'upload_date': upload_date,
                     'duration': file_duration,
                     'formats': formats,
                 })
-                entries.append(file_info)
-            entries_info = info.copy()
-            entries_info.update({
+            return {
                 '_type': 'multi_video',
+                'id': video_id,
+                'title': title,
+                'uploader': uploader,
+                'uploader_id': uploader_id,
+                'thumbnail': thumbnail,
+                'duration': duration,
                 'entries': entries,
-            })
-            return entries_info
+            }
 
         info = {
             'id': video_id,
@@ -349,6 +357,49 @@ class AfreecaTVLiveIE(AfreecaTVIE):  # XXX: Do not subclass from concrete IE
 
     _QUALITIES = ('sd', 'hd', 'hd2k', 'original')
 
+    def _fetch_quality(self, quality_str, quality_key, broadcast_no, stream_base_url, return_type, password):
+        params = {
+            'bno': broadcast_no,
+            'stream_type': 'common',
+            'type': 'aid',
+            'quality': quality_str,
+        }
+        if password is not None:
+            params['pwd'] = password
+        aid_response = self._download_json(
+            self._LIVE_API_URL, broadcast_no, fatal=False,
+            data=urlencode_postdata(params),
+            note=f'Downloading access token for {quality_str} stream',
+            errnote=f'Unable to download access token for {quality_str} stream')
+        aid = traverse_obj(aid_response, ('CHANNEL', 'AID'))
+        if not aid:
+            return []
+
+        stream_info = self._download_json(
+            f'{stream_base_url}/broad_stream_assign.html', broadcast_no, fatal=False,
+            query={
+                'return_type': return_type,
+                'broad_key': f'{broadcast_no}-common-{quality_str}-hls',
+            },
+            note=f'Downloading metadata for {quality_str} stream',
+            errnote=f'Unable to download metadata for {quality_str} stream') or {}
+
+        if not stream_info.get('view_url'):
+            return []
+        m3u8_url = update_url_query(stream_info['view_url'], {'aid': aid})
+        # a master playlist lists its variants, which would otherwise be hidden behind one format
+        return self._extract_m3u8_formats(
+            m3u8_url, broadcast_no, 'mp4', entry_protocol='m3u8', quality=quality_key(quality_str),
+            m3u8_id=quality_str, live=True, fatal=False,
+            note=f'Downloading m3u8 information for {quality_str} stream',
+            errnote=f'Unable to download m3u8 information for {quality_str} stream') or [{
+                'format_id': quality_str,
+                'url': m3u8_url,
+                'ext': 'mp4',
+                'protocol': 'm3u8',
+                'quality': quality_key(quality_str),
+            }]
+
     def _real_extract(self, url):
         broadcaster_id, broadcast_no = self._match_valid_url(url).group('id', 'bno')
         password = self.get_param('videopassword')
@@ -366,44 +417,25 @@ def _real_extract(self, url):
                 'This livestream is protected by a password, use the --video-password option',
                 expected=True)
 
-        formats = []
-        quality_key = qualities(self._QUALITIES)
-        for quality_str in self._QUALITIES:
-            params = {
-                'bno': broadcast_no,
-                'stream_type': 'common',
-                'type': 'aid',
-                'quality': quality_str,
-            }
-            if password is not None:
-                params['pwd'] = password
-            aid_response = self._download_json(
-                self._LIVE_API_URL, broadcast_no, fatal=False,
-                data=urlencode_postdata(params),
-                note=f'Downloading access token for {quality_str} stream',
-                errnote=f'Unable to download access token for {quality_str} stream')
-            aid = traverse_obj(aid_response, ('CHANNEL', 'AID'))
-            if not aid:
-                continue
+        # VIEWPRESET lists the qualities the broadcast is offered in, e.g.
+        # [{'label': '자동', 'label_resolution': '', 'name': 'auto', 'bps': 8000},
+        #  {'label': '원본', 'label_resolution': '1080', 'name': 'original', 'bps': 8000},
+        #  {'label': '고화질', 'label_resolution': '720', 'name': 'hd4k', 'bps': 4000},
+        #  {'label': '일반화질', 'label_resolution': '540', 'name': 'hd', 'bps': 1000},
+        #  {'label': '저화질', 'label_resolution': '360', 'name': 'sd', 'bps': 500}]
+        # 'auto' only selects one of the others, so it is not probed
+        presets = traverse_obj(channel_info, (
+            'VIEWPRESET', lambda _, v: isinstance(v['name'], str) and v['name'] != 'auto'))
+        quality_strs = [preset['name'] for preset in sorted(
+            presets, key=lambda x: int_or_none(x.get('bps')) or 0)] or self._QUALITIES
 
-            stream_base_url = channel_info.get('RMD') or 'https://livestream-manager.afreecatv.com'
-            stream_info = self._download_json(
-                f'{stream_base_url}/broad_stream_assign.html', broadcast_no, fatal=False,
-                query={
-                    'return_type': channel_info.get('CDN', 'gcp_cdn'),
-                    'broad_key': f'{broadcast_no}-common-{quality_str}-hls',
-                },
-                note=f'Downloading metadata for {quality_str} stream',
-                errnote=f'Unable to download metadata for {quality_str} stream') or {}
-
-            if stream_info.get('view_url'):
-                formats.append({
-                    'format_id': quality_str,
-                    'url': update_url_query(stream_info['view_url'], {'aid': aid}),
-                    'ext': 'mp4',
-                    'protocol': 'm3u8',
-                    'quality': quality_key(quality_str),
-                })
+        formats = []
+        quality_key = qualities(quality_strs)
+        stream_base_url = channel_info.get('RMD') or 'https://livestream-manager.afreecatv.com'
+        return_type = channel_info.get('CDN', 'gcp_cdn')
+        for quality_str in quality_strs:
+            formats.extend(self._fetch_quality(
+                quality_str, quality_key, broadcast_no, stream_base_url, return_type, password))
 
         station_info = self._download_json(
             'https://st.afreecatv.com/api/get_station_status.php', broadcast_no,
@@ -459,17 +491,19 @@ class AfreecaTVUserIE(InfoExtractor):
     }]
     _PER_PAGE = 60
 
-    def _fetch_page(self, user_id, user_type, page):
+    def _fetch_page(self, api_url, user_id, user_type, page):
         page += 1
-        info = self._download_json(f'https://bjapi.afreecatv.com/api/{user_id}/vods/{user_type}', user_id,
+        info = self._download_json(api_url, user_id,
                                    query={'page': page, 'per_page': self._PER_PAGE, 'orderby': 'reg_date'},
                                    note=f'Downloading {user_type} video page {page}')
         for item in info['data']:
+            title_no = str(item['title_no'])
             yield self.url_result(
-                f'https://vod.afreecatv.com/player/{item["title_no"]}/', AfreecaTVIE, item['title_no'])
+                f'https://vod.afreecatv.com/player/{title_no}/', AfreecaTVIE, title_no)
 
     def _real_extract(self, url):
         user_id, user_type = self._match_valid_url(url).group('id', 'slug_type')
         user_type = user_type or 'all'
-        entries = OnDemandPagedList(functools.partial(self._fetch_page, user_id, user_type), self._PER_PAGE)
+        api_url = f'https://bjapi.afreecatv.com/api/{user_id}/vods/{user_type}'
+        entries = OnDemandPagedList(functools.partial(self._fetch_page, api_url, user_id, user_type), self._PER_PAGE)
         return self.playlist_result(entries, user_id, f'{user_id} - {user_type}')